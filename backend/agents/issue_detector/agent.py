@@ -1,13 +1,83 @@
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Union
+import os
+import asyncio
+from io import BytesIO
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
 import torch
+import torch.nn.functional as F
 from PIL import Image
 from transformers import CLIPProcessor, CLIPModel
+from clip_onnx import CLIP_MODEL_NAME as DEFAULT_CLIP_MODEL_NAME, ONNX_PATH, OnnxImageEncoder, get_cpu_flags, onnx_available
+
+try:
+    from turbojpeg import TurboJPEG, TJPF_RGB
+except ImportError:
+    TurboJPEG = None
+
+# The 0.2 confidence threshold below was set for ViT-B/32; a smaller backbone such as
+# wkcn/TinyCLIP-ViT-8M-16-Text-3M-YFCC15M needs it re-checked on labelled images first.
+# Export a different model's vision tower with: python clip_onnx.py <CLIP_MODEL_NAME> <CLIP_ONNX_PATH>
+CLIP_MODEL_NAME = os.getenv("ISSUE_DETECTOR_CLIP_MODEL", DEFAULT_CLIP_MODEL_NAME)
+CLIP_ONNX_PATH = os.getenv("ISSUE_DETECTOR_CLIP_ONNX", ONNX_PATH)
+
+# Concurrent requests are coalesced into one CLIP forward pass of up to this many images
+MAX_BATCH_SIZE = 8
+# How long (in seconds) the batcher waits for more images before running a batch
+BATCH_TIMEOUT = 0.01
+# Batch shapes the CUDA vision tower is compiled for; larger partial batches are padded
+COMPILED_BATCH_SIZES = (1, MAX_BATCH_SIZE)
+
+# This module only runs inference, so autograd bookkeeping is never needed
+torch.set_grad_enabled(False)
 
 class IssueDetectorAgent:
     def __init__(self):
-        self.model = CLIPModel.from_pretrained("openai/clip-vit-base-patch32")
-        self.processor = CLIPProcessor.from_pretrained("openai/clip-vit-base-patch32")
-        
+        self.model = CLIPModel.from_pretrained(CLIP_MODEL_NAME)
+        self.processor = CLIPProcessor.from_pretrained(CLIP_MODEL_NAME)
+        self.model.eval()
+        for p in self.model.parameters():
+            p.requires_grad_(False)
+
+        # Run on the GPU in FP16 when one is available, otherwise stay on the CPU
+        self.device = "cuda" if torch.cuda.is_available() else "cpu"
+        self.dtype = torch.float16 if self.device == "cuda" else torch.float32
+
+        # On CPU, prefer the exported ONNX vision encoder when it has been built
+        self._onnx_encoder = None
+        if self.device == "cpu" and onnx_available(CLIP_ONNX_PATH):
+            self._onnx_encoder = OnnxImageEncoder(CLIP_ONNX_PATH)
+
+        if self.device == "cuda":
+            self.model = self.model.to(self.device, dtype=self.dtype)
+        elif self._onnx_encoder is None and "avx512_vnni" in get_cpu_flags():
+            # Quantize the Linear layers to INT8 so the ViT matmuls use fbgemm's VNNI int8 GEMM
+            # kernels; without VNNI they can be slower than FP32, so other CPUs keep FP32 weights
+            self.model = torch.ao.quantization.quantize_dynamic(
+                self.model,
+                {torch.nn.Linear},
+                dtype=torch.qint8
+            )
+
+        # On CUDA, compile the vision tower for fixed shapes so its CUDA graph is replayed
+        self._vision = None
+        if self.device == "cuda":
+            self._vision = torch.compile(
+                self.model.vision_model,
+                mode="reduce-overhead",
+                fullgraph=True,
+                dynamic=False
+            )
+            crop_size = self.processor.image_processor.crop_size
+            # Warm up each compiled shape so graph capture doesn't land on a request
+            for batch_size in COMPILED_BATCH_SIZES:
+                dummy = torch.zeros(
+                    batch_size, 3, crop_size["height"], crop_size["width"],
+                    device=self.device, dtype=self.dtype
+                )
+                with torch.inference_mode():
+                    self._vision(pixel_values=dummy)
+
         # Define common property issues and their recommendations
         self.issues = {
             "water_damage": {
@@ -32,42 +102,145 @@ class IssueDetectorAgent:
             }
         }
 
-    async def analyze_image(self, image_path: str, context: str = "") -> Dict[str, Any]:
-        """Analyze image for property issues"""
+        # Flatten the issue features once, with each feature's (issue type, recommendation)
+        self._all_features = [f for v in self.issues.values() for f in v["features"]]
+        self._feat_meta = [
+            (issue_type, issue_info["recommendation"])
+            for issue_type, issue_info in self.issues.items()
+            for _ in issue_info["features"]
+        ]
+
+        # The feature prompts never change, so encode them with the text tower only once
+        text_inputs = self.processor(
+            text=self._all_features,
+            return_tensors="pt",
+            padding=True
+        ).to(self.device)
+        with torch.inference_mode():
+            self.text_embeds = F.normalize(self.model.get_text_features(**text_inputs).float(), dim=-1)
+            self.logit_scale = self.model.logit_scale.exp().float()
+
+        # libjpeg-turbo decoder for JPEG uploads, when it is installed
+        self._tj = None
+        if TurboJPEG is not None:
+            try:
+                self._tj = TurboJPEG()
+            except OSError:  # Python bindings present but libturbojpeg is missing
+                pass
+
+        # Inference runs on a single worker thread so it never blocks the event loop
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._queue = None
+        self._batch_task = None
+
+    def _preprocess(self, data: bytes) -> torch.Tensor:
+        """Decode image bytes and convert them to CLIP pixel values"""
+        if self._tj is not None and data[:3] == b"\xff\xd8\xff":
+            # JPEG: decode straight to an RGB array with libjpeg-turbo, skipping PIL
+            image = self._tj.decode(data, pixel_format=TJPF_RGB)
+        else:
+            image = Image.open(BytesIO(data))
+            # Decode large JPEGs at a reduced DCT scale; CLIP only needs ~224px
+            image.draft("RGB", (448, 448))
+        return self.processor(images=image, return_tensors="pt")["pixel_values"]
+
+    def _encode_images(self, pixel_values: torch.Tensor) -> torch.Tensor:
+        """Return raw CLIP image embeddings for a batch"""
+        if self._onnx_encoder is not None:
+            return torch.from_numpy(self._onnx_encoder(pixel_values.numpy()))
+        if self._vision is not None:
+            return self._encode_images_compiled(pixel_values)
+        # CPU without an ONNX export: eager FP32 (or INT8-quantized) model
+        return self.model.get_image_features(pixel_values=pixel_values)
+
+    def _encode_images_compiled(self, pixel_values: torch.Tensor) -> torch.Tensor:
+        """Run the compiled CUDA vision tower, padding the batch to a compiled shape"""
+        batch_size = pixel_values.shape[0]
+        padded_size = next(size for size in COMPILED_BATCH_SIZES if size >= batch_size)
+        if padded_size != batch_size:
+            padding = pixel_values.new_zeros((padded_size - batch_size, *pixel_values.shape[1:]))
+            pixel_values = torch.cat([pixel_values, padding])
+
+        pixel_values = pixel_values.to(self.device, dtype=self.dtype)
+        pooled_output = self._vision(pixel_values=pixel_values).pooler_output
+        image_embeds = self.model.visual_projection(pooled_output[:batch_size])
+        # Copy out in FP32 before the next graph replay overwrites the output buffers
+        return image_embeds.float()
+
+    def _infer_sync(self, pixel_values: torch.Tensor) -> torch.Tensor:
+        """Run the image tower on a batch and return per-feature probabilities"""
+        with torch.inference_mode():
+            image_embeds = F.normalize(self._encode_images(pixel_values), dim=-1)
+            logits_per_image = image_embeds @ self.text_embeds.T * self.logit_scale
+            return logits_per_image.softmax(dim=1).cpu()
+
+    async def _batch_worker(self):
+        """Collect pending images into batches and run them through CLIP together"""
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + BATCH_TIMEOUT
+            while len(batch) < MAX_BATCH_SIZE:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            pixel_values = torch.cat([item[0] for item in batch])
+            try:
+                probs = await loop.run_in_executor(self._executor, self._infer_sync, pixel_values)
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            for (_, future), image_probs in zip(batch, probs):
+                if not future.done():
+                    future.set_result(image_probs)
+
+    async def _predict(self, pixel_values: torch.Tensor) -> torch.Tensor:
+        """Queue an image for the next batch and wait for its probabilities"""
+        if self._batch_task is None or self._batch_task.done():
+            self._queue = asyncio.Queue()
+            self._batch_task = asyncio.create_task(self._batch_worker())
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((pixel_values, future))
+        return await future
+
+    async def analyze_image(self, image: Union[str, bytes, BytesIO], context: str = "") -> Dict[str, Any]:
+        """Analyze image (a file path or the raw image bytes) for property issues"""
         try:
-            # Prepare all features for CLIP
-            all_features = []
-            for issue in self.issues.values():
-                all_features.extend(issue["features"])
-            
-            # Load and process image
-            image = Image.open(image_path)
-            inputs = self.processor(
-                images=image,
-                text=all_features,
-                return_tensors="pt",
-                padding=True
-            )
+            # Decode in memory; only a path needs a (threaded) file read
+            if isinstance(image, str):
+                data = await asyncio.to_thread(Path(image).read_bytes)
+            elif isinstance(image, BytesIO):
+                data = image.getvalue()
+            else:
+                data = bytes(image)
+
+            # Process image off the event loop
+            pixel_values = await asyncio.to_thread(self._preprocess, data)
             
-            # Get model predictions
-            with torch.no_grad():
-                outputs = self.model(**inputs)
-                logits_per_image = outputs.logits_per_image
-                probs = logits_per_image.softmax(dim=1)[0]
+            # Get model predictions (batched with any concurrent requests)
+            probs = await self._predict(pixel_values)
             
-            # Process results
+            # Select features above the confidence threshold in one vectorized call
+            idxs = (probs > 0.2).nonzero(as_tuple=True)[0].tolist()  # Confidence threshold
+            confs = probs[idxs].tolist()
             detected_issues = []
-            for i, (feature, confidence) in enumerate(zip(all_features, probs.tolist())):
-                if confidence > 0.2:  # Confidence threshold
-                    # Find which issue category this feature belongs to
-                    for issue_type, issue_info in self.issues.items():
-                        if feature in issue_info["features"]:
-                            detected_issues.append({
-                                "type": issue_type,
-                                "feature": feature,
-                                "confidence": confidence,
-                                "recommendation": issue_info["recommendation"]
-                            })
+            for i, confidence in zip(idxs, confs):
+                issue_type, recommendation = self._feat_meta[i]
+                detected_issues.append({
+                    "type": issue_type,
+                    "feature": self._all_features[i],
+                    "confidence": confidence,
+                    "recommendation": recommendation
+                })
+            detected_issues.sort(key=lambda x: -x["confidence"])
             
             # Generate response
             if not detected_issues:
@@ -76,9 +249,6 @@ class IssueDetectorAgent:
                     "detected_issues": []
                 }
             
-            # Sort issues by confidence
-            detected_issues.sort(key=lambda x: x["confidence"], reverse=True)
-            
             # Generate detailed response
             response = "I've detected the following issues:\n\n"
             for issue in detected_issues:
@@ -97,4 +267,13 @@ class IssueDetectorAgent:
             return {
                 "response": f"Error analyzing image: {str(e)}",
                 "detected_issues": []
-            } 
\ No newline at end of file
+            }
+
+_issue_detector = None
+
+def get_issue_detector() -> IssueDetectorAgent:
+    """Process-wide IssueDetectorAgent, loaded once and shared by every router"""
+    global _issue_detector
+    if _issue_detector is None:
+        _issue_detector = IssueDetectorAgent()
+    return _issue_detector
\ No newline at end of file
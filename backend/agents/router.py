@@ -1,10 +1,18 @@
 from typing import Optional, Dict, Any
-from .issue_detector.agent import IssueDetectorAgent
+import ahocorasick
+from .issue_detector.agent import get_issue_detector
 from .faq_agent.agent import TenancyFAQAgent
 
+# Each tenancy keyword owns a bit in the low 16 bits, each issue keyword one in the high 16
+TENANCY_BITS = 0x0000FFFF
+ISSUE_BITS = 0xFFFF0000
+
+# Route for a message, indexed by (has_issue << 1) | has_tenancy
+_ROUTES = ("router", "tenancy_faq", "issue_detector", "tenancy_faq")
+
 class AgentRouter:
     def __init__(self):
-        self.issue_detector = IssueDetectorAgent()
+        self.issue_detector = get_issue_detector()
         self.tenancy_faq = TenancyFAQAgent()
         
         # Keywords for classification
@@ -17,6 +25,17 @@ class AgentRouter:
             "repair", "fix", "issue", "problem", "wrong"
         ]
 
+        # Compile both keyword sets into one automaton so a message is scanned once
+        self._kw_bits = {}
+        for i, keyword in enumerate(self.tenancy_keywords):
+            self._kw_bits[keyword] = 1 << i
+        for i, keyword in enumerate(self.issue_keywords):
+            self._kw_bits[keyword] = 1 << (16 + i)
+        self._automaton = ahocorasick.Automaton()
+        for keyword, bit in self._kw_bits.items():
+            self._automaton.add_word(keyword, bit)
+        self._automaton.make_automaton()
+
     async def route_message(
         self, 
         message: str, 
@@ -29,19 +48,23 @@ class AgentRouter:
         if image_path:
             return await self.issue_detector.analyze_image(image_path, message)
             
-        # Check message keywords for routing
+        # Lowercase once; the FAQ agent reuses this copy
         message_lower = message.lower()
+        mask = 0
+        for _, bit in self._automaton.iter(message_lower):
+            mask |= bit
+        route = _ROUTES[bool(mask & TENANCY_BITS) | bool(mask & ISSUE_BITS) << 1]
         
         # Check for tenancy-related keywords
-        if any(keyword in message_lower for keyword in self.tenancy_keywords):
-            response = await self.tenancy_faq.get_response(message, location)
+        if route == "tenancy_faq":
+            response = await self.tenancy_faq.get_response(message_lower, location)
             return {
                 "agent": "tenancy_faq",
                 "response": response
             }
             
         # Check for issue-related keywords
-        if any(keyword in message_lower for keyword in self.issue_keywords):
+        if route == "issue_detector":
             return {
                 "agent": "issue_detector",
                 "response": "I can help you better if you upload an image of the issue. Could you please share a photo?"
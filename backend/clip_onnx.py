@@ -0,0 +1,101 @@
+"""
+Export the CLIP vision tower to ONNX and run it with ONNX Runtime.
+
+The export only has to happen once:
+
+    python clip_onnx.py [model_name] [output_path]
+"""
+import os
+import sys
+from typing import Optional
+import numpy as np
+import torch
+
+try:
+    import onnxruntime as ort
+except ImportError:
+    ort = None
+
+CLIP_MODEL_NAME = "openai/clip-vit-base-patch32"
+ONNX_PATH = os.getenv("CLIP_VISION_ONNX", "clip_vision.onnx")
+
+class _VisionEncoder(torch.nn.Module):
+    """Vision tower plus projection, so the graph outputs CLIP image embeddings"""
+
+    def __init__(self, model):
+        super().__init__()
+        self.vision_model = model.vision_model
+        self.visual_projection = model.visual_projection
+
+    def forward(self, pixel_values):
+        pooled_output = self.vision_model(pixel_values=pixel_values)[1]
+        return self.visual_projection(pooled_output)
+
+def export_vision_encoder(model, path: str = ONNX_PATH):
+    """Export the image embedding path of a CLIPModel with a dynamic batch axis"""
+    encoder = _VisionEncoder(model).eval()
+    dummy = torch.randn(1, 3, 224, 224)
+    with torch.inference_mode():
+        torch.onnx.export(
+            encoder,
+            (dummy,),
+            path,
+            opset_version=17,
+            input_names=["pixel_values"],
+            output_names=["image_embeds"],
+            dynamic_axes={"pixel_values": {0: "B"}, "image_embeds": {0: "B"}}
+        )
+
+def get_cpu_flags() -> set:
+    """CPU feature flags from /proc/cpuinfo (empty where it isn't available)"""
+    try:
+        with open("/proc/cpuinfo") as f:
+            for line in f:
+                if line.startswith("flags"):
+                    return set(line.split(":", 1)[1].split())
+    except OSError:
+        pass
+    return set()
+
+def onnx_available(path: str = ONNX_PATH) -> bool:
+    """Whether ONNX Runtime is installed and the exported model exists"""
+    return ort is not None and os.path.exists(path)
+
+class OnnxImageEncoder:
+    """Runs the exported vision encoder with full graph optimization and IOBinding"""
+
+    def __init__(self, path: str = ONNX_PATH, num_threads: Optional[int] = None):
+        so = ort.SessionOptions()
+        so.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        # Default to torch's intra-op thread count, which gunicorn sets per worker
+        so.intra_op_num_threads = num_threads or torch.get_num_threads()
+        self.session = ort.InferenceSession(path, sess_options=so, providers=["CPUExecutionProvider"])
+        self.embed_dim = self.session.get_outputs()[0].shape[1]
+        self._binding = self.session.io_binding()
+        self._outputs = {}  # batch size -> preallocated output buffer
+
+    def __call__(self, pixel_values: np.ndarray) -> np.ndarray:
+        """
+        Return image embeddings for a (B, 3, H, W) batch.
+        The returned array is reused by the next call with the same batch size.
+        """
+        pixel_values = np.ascontiguousarray(pixel_values, dtype=np.float32)
+        batch_size = pixel_values.shape[0]
+        output = self._outputs.get(batch_size)
+        if output is None:
+            output = self._outputs[batch_size] = np.empty((batch_size, self.embed_dim), dtype=np.float32)
+
+        self._binding.bind_cpu_input("pixel_values", pixel_values)
+        self._binding.bind_output(
+            "image_embeds", "cpu", 0, np.float32, output.shape, output.ctypes.data
+        )
+        self.session.run_with_iobinding(self._binding)
+        return output
+
+if __name__ == "__main__":
+    from transformers import CLIPModel
+
+    model_name = sys.argv[1] if len(sys.argv) > 1 else CLIP_MODEL_NAME
+    output_path = sys.argv[2] if len(sys.argv) > 2 else ONNX_PATH
+    export_vision_encoder(CLIPModel.from_pretrained(model_name), output_path)
+    print(f"Exported {model_name} vision encoder to {output_path}")
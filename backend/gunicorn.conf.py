@@ -0,0 +1,24 @@
+# Gunicorn settings for running the API with several uvicorn workers:
+#
+#     gunicorn main:app -c gunicorn.conf.py
+import multiprocessing
+import os
+
+# Probe for a GPU through NVML; the default check initializes CUDA in the master,
+# after which forked workers can no longer use it
+os.environ.setdefault("PYTORCH_NVML_BASED_CUDA_CHECK", "1")
+import torch
+
+bind = "0.0.0.0:8000"
+worker_class = "uvicorn.workers.UvicornWorker"
+
+# GPU hosts run a single worker and rely on the CLIP micro-batcher for concurrency
+workers = 1 if torch.cuda.is_available() else max(1, multiprocessing.cpu_count() - 1)
+
+# The app is imported and CLIP loaded in each worker (its lifespan handler), not in the master:
+# the compiled warmup starts OpenMP threads that don't survive a fork. Workers still share
+# the weights through the page cache when they are memory-mapped (see main.export_clip_weights)
+
+def post_fork(server, worker):
+    # Split the cores between the workers rather than giving each one a thread per core
+    torch.set_num_threads(max(1, multiprocessing.cpu_count() // server.cfg.workers))
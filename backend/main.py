@@ -1,37 +1,259 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, BackgroundTasks, Depends, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, ORJSONResponse
 from pydantic import BaseModel
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Final
 import os
 from dotenv import load_dotenv
 import torch
+from torchvision.transforms import v2 as transforms
 from PIL import Image
-from transformers import CLIPProcessor, CLIPModel
-import cloudinary
-import cloudinary.uploader
+from transformers import CLIPConfig, CLIPProcessor, CLIPModel
 import numpy as np
 from datetime import datetime
-import requests
 from io import BytesIO
 import shutil
-import aiofiles
-import time
 import json
+import msgspec
+import re
+import hashlib
+import uuid
+import imagehash
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import ahocorasick
+from cachetools import TTLCache
+from types import MappingProxyType
 
-from database import get_db, get_vector_store
+from database import get_vector_store, get_uploader, get_async_db
+from clip_onnx import CLIP_MODEL_NAME, ONNX_PATH, OnnxImageEncoder, get_cpu_flags, onnx_available
 
 # Load environment variables
 load_dotenv()
 
-# Configure Cloudinary
-cloudinary.config(
-    cloud_name = os.getenv('CLOUDINARY_CLOUD_NAME'),
-    api_key = os.getenv('CLOUDINARY_API_KEY'),
-    api_secret = os.getenv('CLOUDINARY_API_SECRET')
-)
+# This process only runs inference, so autograd bookkeeping is never needed
+torch.set_grad_enabled(False)
+
+# CLIP model state, populated by load_clip() when the app starts
+device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+model = None
+model_dtype = torch.float32
+processor = None
+encode_image = None
+TEXT_EMB = None
+LOGIT_SCALE = None
+image_transform = None
+onnx_encoder = None
+compiled_vision = None
+inference_path = None  # "onnx", "int8", "bfloat16", "float16" or "float32"
+
+# Optional local copy of the CLIP weights, written once with
+#     python -c "import main; main.export_clip_weights()"
+# It is memory-mapped, so every process serving the model reads the same pages from the OS page cache
+CLIP_WEIGHTS_PATH = os.getenv("CLIP_WEIGHTS", "clip.pt")
+
+# Concurrent uploads are coalesced into one image-tower forward of up to this many images
+MAX_BATCH = 16
+# How long (in seconds) the batcher waits for more images after the first one arrives
+BATCH_WINDOW = 0.01
+# Batch shapes the vision tower is compiled for; partial batches are padded up to one of these
+COMPILED_BATCH_SIZES = (1, 4, MAX_BATCH)
+_batch_queue = None
+# The image tower runs on one worker thread so it never blocks the event loop
+_batch_executor = ThreadPoolExecutor(max_workers=1)
+
+# Property features CLIP scores each uploaded image against
+FEATURES = [
+    "water damage", "mold growth", "structural cracks", "poor lighting",
+    "broken fixtures", "paint peeling", "electrical issues", "plumbing problems",
+    "ceiling damage", "wall damage", "floor damage", "window issues"
+]
+
+def to_model_inputs(inputs) -> Dict[str, torch.Tensor]:
+    """Move processor outputs to the model device, casting float tensors to the model dtype"""
+    return {
+        k: v.to(device, dtype=model_dtype) if v.is_floating_point() else v.to(device)
+        for k, v in inputs.items()
+    }
+
+def _encode_image_onnx(pixel_values: torch.Tensor) -> torch.Tensor:
+    """Image embeddings from the ONNX Runtime vision encoder"""
+    # Copy out, since the encoder reuses its output buffer on the next call
+    return torch.from_numpy(onnx_encoder(pixel_values.numpy()).copy())
+
+def _encode_image_compiled(pixel_values: torch.Tensor) -> torch.Tensor:
+    """Run the compiled vision tower, padding the batch to a compiled shape"""
+    batch_size = pixel_values.shape[0]
+    padded_size = next(size for size in COMPILED_BATCH_SIZES if size >= batch_size)
+    if padded_size != batch_size:
+        padding = pixel_values.new_zeros((padded_size - batch_size, *pixel_values.shape[1:]))
+        pixel_values = torch.cat([pixel_values, padding])
+    pooled_output = compiled_vision(pixel_values=pixel_values).pooler_output
+    return model.visual_projection(pooled_output[:batch_size])
+
+def export_clip_weights(path: str = CLIP_WEIGHTS_PATH):
+    """Save the CLIP weights to path for memory-mapped loading at startup"""
+    clip = CLIPModel.from_pretrained(CLIP_MODEL_NAME)
+    # Non-persistent buffers (position ids) are left out of state_dict(), so save them too
+    torch.save({**clip.state_dict(), **dict(clip.named_buffers())}, path)
+
+def _load_clip_model() -> CLIPModel:
+    """CLIPModel backed by the memory-mapped weights file if it exists, otherwise from the hub"""
+    if not os.path.exists(CLIP_WEIGHTS_PATH):
+        return CLIPModel.from_pretrained(CLIP_MODEL_NAME)
+
+    # Build the module on the meta device so no weights are allocated, then adopt the
+    # mmap'd tensors as parameters instead of copying them into fresh ones
+    with torch.device("meta"):
+        clip = CLIPModel(CLIPConfig.from_pretrained(CLIP_MODEL_NAME))
+    state = torch.load(CLIP_WEIGHTS_PATH, mmap=True, map_location="cpu", weights_only=True)
+    clip.load_state_dict(state, strict=False, assign=True)
+    for name, tensor in list(clip.named_parameters()) + list(clip.named_buffers()):
+        if name not in state:
+            raise RuntimeError(f"{CLIP_WEIGHTS_PATH} is missing {name}")
+        if tensor.is_meta:
+            module_name, _, buffer_name = name.rpartition(".")
+            clip.get_submodule(module_name).register_buffer(buffer_name, state[name], persistent=False)
+    return clip
+
+def load_clip():
+    """Load CLIP once per process, cache the feature text embeddings and warm up the image tower"""
+    global model, model_dtype, processor, encode_image, TEXT_EMB, LOGIT_SCALE, image_transform, onnx_encoder
+    global compiled_vision, inference_path
+
+    model = _load_clip_model().eval()
+    if device.type == "cuda":
+        # FP16 halves the bytes moved through the ViT on tensor-core GPUs
+        model = model.to(device).half()
+    model_dtype = next(model.parameters()).dtype
+    processor = CLIPProcessor.from_pretrained(CLIP_MODEL_NAME)
+
+    # The feature labels never change, so run the text tower for them once at startup
+    with torch.inference_mode():
+        text_emb = model.get_text_features(
+            **to_model_inputs(processor(text=FEATURES, return_tensors="pt", padding=True))
+        ).float()
+        # Kept as a contiguous float32 numpy matrix, since scoring 12 labels is a
+        # tiny matvec where torch dispatch overhead would dominate
+        TEXT_EMB = np.ascontiguousarray((text_emb / text_emb.norm(dim=-1, keepdim=True)).cpu().numpy())
+        LOGIT_SCALE = model.logit_scale.exp().item()
 
-app = FastAPI(title="Real Estate Chatbot API")
+    # Resize/crop/normalize as tensor ops on the model device instead of the processor's PIL
+    # path; the processor is only needed for tokenizing the labels above
+    image_processor = processor.image_processor
+    image_transform = transforms.Compose([
+        transforms.Resize(
+            image_processor.size["shortest_edge"],
+            interpolation=transforms.InterpolationMode.BICUBIC,
+            antialias=True
+        ),
+        transforms.CenterCrop((image_processor.crop_size["height"], image_processor.crop_size["width"])),
+        transforms.ToDtype(torch.float32, scale=True),
+        transforms.Normalize(mean=image_processor.image_mean, std=image_processor.image_std)
+    ])
+
+    cpu_flags = get_cpu_flags() if device.type == "cpu" else set()
+    # CPUs with native BF16 matmuls (AVX512-BF16 / AMX) run the compiled tower in BF16 instead
+    cpu_bf16 = bool(cpu_flags & {"avx512_bf16", "amx_bf16"})
+
+    if device.type == "cpu" and onnx_available(ONNX_PATH):
+        # Serve the exported vision encoder (python clip_onnx.py) with ONNX Runtime on CPU
+        onnx_encoder = OnnxImageEncoder(ONNX_PATH)
+        encode_image = _encode_image_onnx
+        inference_path = "onnx"
+    elif "avx512_vnni" in cpu_flags and not cpu_bf16:
+        # INT8 Linear layers hit fbgemm's VNNI GEMM kernels; without VNNI they can be slower
+        # than FP32, so other CPUs keep the FP32 weights. The text embeddings above stay FP32.
+        model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        # Dynamic-quantized ops don't go through the compiler, so run the image tower eagerly
+        encode_image = model.get_image_features
+        inference_path = "int8"
+    else:
+        if cpu_bf16:
+            # Cast after the text embeddings above so those stay FP32
+            model = model.to(torch.bfloat16)
+            model_dtype = torch.bfloat16
+        # Only the vision tower runs per request. Every image is cropped to the same size, so
+        # compile it for static shapes and leave the projection eager
+        compiled_vision = torch.compile(model.vision_model, mode="reduce-overhead", dynamic=False)
+        encode_image = _encode_image_compiled
+        inference_path = str(model_dtype).removeprefix("torch.")
+        crop_size = image_processor.crop_size
+        for batch_size in COMPILED_BATCH_SIZES:
+            dummy = torch.zeros(
+                batch_size, 3, crop_size["height"], crop_size["width"],
+                device=device, dtype=model_dtype
+            )
+            with torch.inference_mode():
+                compiled_vision(pixel_values=dummy)
+
+    # Warm up the image tower so the first real request doesn't pay the compile cost
+    with torch.inference_mode():
+        encode_image(pixel_values=preprocess_image(Image.new("RGB", (224, 224))).to(model_dtype))
+
+    _init_disk_cache()
+
+def preprocess_image(image: Image.Image) -> torch.Tensor:
+    """Turn an RGB image into a (1, 3, H, W) batch of CLIP pixel values on the model device"""
+    pixels = transforms.functional.pil_to_tensor(image).to(device, non_blocking=True)
+    return image_transform(pixels).unsqueeze(0)
+
+def _encode_batch(pixel_values: torch.Tensor) -> torch.Tensor:
+    """Run the image tower on a stacked batch of pixel values"""
+    with torch.inference_mode():
+        pixel_values = pixel_values.to(device, dtype=model_dtype, non_blocking=True)
+        return encode_image(pixel_values=pixel_values).float().cpu()
+
+async def _batch_worker():
+    """Drain pending images into one batch, run CLIP once and hand each request its embedding"""
+    loop = asyncio.get_running_loop()
+    while True:
+        items = [await _batch_queue.get()]
+        deadline = loop.time() + BATCH_WINDOW
+        while len(items) < MAX_BATCH:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                items.append(await asyncio.wait_for(_batch_queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+
+        pixel_values = torch.cat([pv for pv, _ in items], 0)
+        try:
+            embs = await loop.run_in_executor(_batch_executor, _encode_batch, pixel_values)
+        except Exception as e:
+            for _, fut in items:
+                if not fut.done():
+                    fut.set_exception(e)
+            continue
+
+        for i, (_, fut) in enumerate(items):
+            if not fut.done():
+                fut.set_result(embs[i])
+
+async def submit_image(pixel_values: torch.Tensor) -> torch.Tensor:
+    """Queue pixel values for the next batch and wait for their image embedding"""
+    fut = asyncio.get_running_loop().create_future()
+    await _batch_queue.put((pixel_values, fut))
+    return await fut
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global _batch_queue
+    # Load the model when the server starts rather than at import time
+    # (in each worker, so its compile/warmup threads are never forked)
+    load_clip()
+    await _uploads().create_index("created_at", expireAfterSeconds=UPLOAD_STATUS_TTL)
+    _batch_queue = asyncio.Queue()
+    batch_task = asyncio.create_task(_batch_worker())
+    yield
+    batch_task.cancel()
+
+# orjson serializes the nested analysis dicts much faster than the stdlib encoder
+app = FastAPI(title="Real Estate Chatbot API", lifespan=lifespan, default_response_class=ORJSONResponse)
 
 # Configure CORS with more specific settings
 app.add_middleware(
@@ -43,53 +265,58 @@ app.add_middleware(
     expose_headers=["*"]
 )
 
-# Initialize CLIP model and processor
-model = CLIPModel.from_pretrained("openai/clip-vit-base-patch32")
-processor = CLIPProcessor.from_pretrained("openai/clip-vit-base-patch32")
-
-class ChatMessage(BaseModel):
+class ChatMessage(msgspec.Struct):
     message: str
+    session_id: Optional[str] = None
     location: Optional[str] = None
     last_analysis: Optional[Dict[str, Any]] = None
 
+# /chat bodies are decoded and validated by msgspec straight from the raw bytes,
+# skipping pydantic's model validation on the hottest endpoint
+_chat_message_decoder = msgspec.json.Decoder(ChatMessage)
+
+async def parse_chat_message(request: Request) -> ChatMessage:
+    try:
+        return _chat_message_decoder.decode(await request.body())
+    except msgspec.DecodeError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
 class PropertyFeature(BaseModel):
     feature: str
     confidence: float
     recommendation: str
 
-class RealEstateTextAgent:
-    def __init__(self):
-        # Knowledge base for common real estate queries
-        self.knowledge_base = {
-            "notice_period": {
-                "question_patterns": ["notice", "vacating", "move out", "leaving"],
-                "response": """The notice period typically depends on your lease agreement and local laws, but generally:
+# Knowledge base for common real estate queries
+KNOWLEDGE_BASE = MappingProxyType({
+    "notice_period": {
+        "question_patterns": ["notice", "vacating", "move out", "leaving"],
+        "response": """The notice period typically depends on your lease agreement and local laws, but generally:
                 1. For month-to-month tenancy: 30 days notice is standard
                 2. For fixed-term leases: Check your lease agreement
                 3. Some jurisdictions require 60 days notice
                 Always provide written notice and check your specific lease terms."""
-            },
-            "rent_increase": {
-                "question_patterns": ["increase rent", "raise rent", "rent hike"],
-                "response": """Regarding rent increases during a contract:
+    },
+    "rent_increase": {
+        "question_patterns": ["increase rent", "raise rent", "rent hike"],
+        "response": """Regarding rent increases during a contract:
                 1. During a fixed-term lease: Landlord cannot increase rent unless specified in the lease
                 2. For month-to-month: Usually requires 30-60 days written notice
                 3. Check local rent control laws
                 4. Increases must be reasonable and follow local regulations"""
-            },
-            "deposit_issues": {
-                "question_patterns": ["deposit", "security deposit", "not returning deposit"],
-                "response": """If your landlord isn't returning your deposit:
+    },
+    "deposit_issues": {
+        "question_patterns": ["deposit", "security deposit", "not returning deposit"],
+        "response": """If your landlord isn't returning your deposit:
                 1. Review your lease agreement
                 2. Document property condition with photos/videos
                 3. Send a formal written request
                 4. Know your timeline (usually 21-30 days)
                 5. Consider small claims court if necessary
                 6. Contact local tenant rights organization"""
-            },
-            "rental_agreement": {
-                "question_patterns": ["rental agreement", "lease agreement", "before signing", "documents check"],
-                "response": """Key documents to check before signing a rental agreement:
+    },
+    "rental_agreement": {
+        "question_patterns": ["rental agreement", "lease agreement", "before signing", "documents check"],
+        "response": """Key documents to check before signing a rental agreement:
                 1. Lease agreement terms and conditions
                 2. Property inspection report
                 3. Maintenance responsibilities
@@ -98,30 +325,30 @@ class RealEstateTextAgent:
                 6. Pet policies
                 7. Insurance requirements
                 8. Property ownership verification"""
-            },
-            "landlord_entry": {
-                "question_patterns": ["landlord enter", "entry without notice", "access property"],
-                "response": """Regarding landlord entry:
+    },
+    "landlord_entry": {
+        "question_patterns": ["landlord enter", "entry without notice", "access property"],
+        "response": """Regarding landlord entry:
                 1. Usually requires 24-48 hours notice
                 2. Exceptions for emergencies
                 3. Must be during reasonable hours
                 4. Should have legitimate reason
                 5. Document unauthorized entries
                 6. Know your right to privacy"""
-            },
-            "subletting": {
-                "question_patterns": ["sublet", "sublease", "rent out"],
-                "response": """Regarding subletting:
+    },
+    "subletting": {
+        "question_patterns": ["sublet", "sublease", "rent out"],
+        "response": """Regarding subletting:
                 1. Check your lease agreement first
                 2. Get written permission from landlord
                 3. Screen potential subtenants
                 4. Create a formal sublease agreement
                 5. Understand you're still responsible to the landlord
                 6. Consider insurance implications"""
-            },
-            "maintenance_issues": {
-                "question_patterns": ["maintenance", "repairs", "fixing"],
-                "response": """Your rights regarding maintenance issues:
+    },
+    "maintenance_issues": {
+        "question_patterns": ["maintenance", "repairs", "fixing"],
+        "response": """Your rights regarding maintenance issues:
                 1. Right to habitable living conditions
                 2. Document all issues with photos/videos
                 3. Submit written repair requests
@@ -129,10 +356,10 @@ class RealEstateTextAgent:
                 5. Know repair timeline requirements
                 6. Possible remedies: rent withholding, repair and deduct
                 7. Contact housing authorities if necessary"""
-            },
-            "property_verification": {
-                "question_patterns": ["verify property", "check ownership", "legal owner"],
-                "response": """Steps to verify property ownership:
+    },
+    "property_verification": {
+        "question_patterns": ["verify property", "check ownership", "legal owner"],
+        "response": """Steps to verify property ownership:
                 1. Check public property records
                 2. Request title search
                 3. Verify tax records
@@ -140,10 +367,10 @@ class RealEstateTextAgent:
                 5. Use online property databases
                 6. Consider title insurance
                 7. Consult a real estate attorney"""
-            },
-            "buying_process": {
-                "question_patterns": ["buying house", "purchase property", "steps buying"],
-                "response": """Steps in buying a house:
+    },
+    "buying_process": {
+        "question_patterns": ["buying house", "purchase property", "steps buying"],
+        "response": """Steps in buying a house:
                 1. Check financial readiness
                 2. Get pre-approved for mortgage
                 3. Find a real estate agent
@@ -153,10 +380,10 @@ class RealEstateTextAgent:
                 7. Property appraisal
                 8. Final mortgage approval
                 9. Closing process"""
-            },
-            "property_taxes": {
-                "question_patterns": ["property tax", "tax when buying", "purchase tax"],
-                "response": """Taxes involved in property purchase:
+    },
+    "property_taxes": {
+        "question_patterns": ["property tax", "tax when buying", "purchase tax"],
+        "response": """Taxes involved in property purchase:
                 1. Property transfer tax
                 2. Stamp duty (varies by location)
                 3. Registration charges
@@ -164,10 +391,10 @@ class RealEstateTextAgent:
                 5. GST on new constructions
                 6. Annual property tax
                 Consider consulting a tax professional."""
-            },
-            "hidden_charges": {
-                "question_patterns": ["hidden charges", "additional costs", "extra fees"],
-                "response": """Common hidden charges in real estate:
+    },
+    "hidden_charges": {
+        "question_patterns": ["hidden charges", "additional costs", "extra fees"],
+        "response": """Common hidden charges in real estate:
                 1. Property taxes
                 2. Insurance costs
                 3. Maintenance fees
@@ -177,10 +404,10 @@ class RealEstateTextAgent:
                 7. Legal fees
                 8. Broker commission
                 9. Renovation/repair costs"""
-            },
-            "property_dispute": {
-                "question_patterns": ["dispute", "litigation", "legal issues"],
-                "response": """To check for property disputes:
+    },
+    "property_dispute": {
+        "question_patterns": ["dispute", "litigation", "legal issues"],
+        "response": """To check for property disputes:
                 1. Search court records
                 2. Check with local property registrar
                 3. Review title insurance report
@@ -188,161 +415,220 @@ class RealEstateTextAgent:
                 5. Check for encumbrances
                 6. Verify tax payment history
                 7. Review property documents"""
-            }
-        }
+    }
+})
+
+def _build_kb_index():
+    """Compile every question pattern into one automaton whose payload is the pattern's row in
+    a (patterns x topics) incidence matrix"""
+    patterns = {}  # pattern -> row
+    for topic in _TOPICS:
+        for pattern in KNOWLEDGE_BASE[topic]["question_patterns"]:
+            patterns.setdefault(pattern.lower(), len(patterns))
+
+    incidence = np.zeros((len(patterns), len(_TOPICS)), dtype=np.int32)
+    for j, topic in enumerate(_TOPICS):
+        for pattern in KNOWLEDGE_BASE[topic]["question_patterns"]:
+            incidence[patterns[pattern.lower()], j] = 1
+
+    automaton = ahocorasick.Automaton()
+    for pattern, row in patterns.items():
+        automaton.add_word(pattern, row)
+    automaton.make_automaton()
+    return automaton, incidence
+
+_TOPICS = tuple(KNOWLEDGE_BASE)
+_KB_AUTOMATON, _KB_INCIDENCE = _build_kb_index()
+
+class RealEstateTextAgent:
+    def __init__(self):
+        self.knowledge_base = KNOWLEDGE_BASE
+        self._topics = _TOPICS
+        self._automaton = _KB_AUTOMATON
+        self._incidence = _KB_INCIDENCE
 
     def find_best_match(self, query: str) -> str:
-        query = query.lower()
-        best_match = None
-        max_matches = 0
-
-        for topic, data in self.knowledge_base.items():
-            matches = sum(1 for pattern in data["question_patterns"] if pattern.lower() in query)
-            if matches > max_matches:
-                max_matches = matches
-                best_match = topic
-
-        if best_match:
-            return self.knowledge_base[best_match]["response"]
+        # Callers may pass an already-lowercased message; don't copy it again
+        if not query.islower():
+            query = query.lower()
+
+        # One pass over the query; each distinct pattern counts once for its topics
+        found = {row for _, row in self._automaton.iter(query)}
+
+        if found:
+            # Sum the matched rows into per-topic hit counts; argmax picks the most hits,
+            # with ties going to the topic listed first
+            matches = self._incidence[list(found)].sum(axis=0)
+            best_match = int(matches.argmax())
+            return self.knowledge_base[self._topics[best_match]]["response"]
         
         return """I apologize, but I don't have specific information about that query. 
                 Please rephrase your question or consult with a real estate professional or legal expert for accurate advice."""
 
+# Professionals to contact for each issue type
+PROFESSIONALS = MappingProxyType({
+    "structural_damage": {
+        "professionals": [
+            "Structural Engineer",
+            "Licensed Building Contractor",
+            "Foundation Specialist",
+            "Construction Project Manager"
+        ],
+        "qualifications": "Look for professionals with:\n- Licensed structural engineer certification\n- Experience with foundation repairs\n- Local building code knowledge\n- Insurance and bonding"
+    },
+    "water_damage": {
+        "professionals": [
+            "Water Damage Restoration Specialist",
+            "Licensed Plumber",
+            "Moisture Control Expert",
+            "Building Inspector"
+        ],
+        "qualifications": "Look for professionals with:\n- IICRC certification\n- Water damage restoration experience\n- Mold remediation knowledge\n- Insurance claim experience"
+    },
+    "mold": {
+        "professionals": [
+            "Certified Mold Inspector",
+            "Mold Remediation Specialist",
+            "Indoor Air Quality Expert",
+            "Environmental Hygienist"
+        ],
+        "qualifications": "Look for professionals with:\n- IICRC or ACAC certification\n- Mold assessment experience\n- Air quality testing capabilities\n- Remediation protocol knowledge"
+    },
+    "window_issues": {
+        "professionals": [
+            "Window Installation Specialist",
+            "Glass Repair Technician",
+            "Energy Efficiency Expert",
+            "General Contractor"
+        ],
+        "qualifications": "Look for professionals with:\n- Window installation certification\n- Energy efficiency expertise\n- Weatherization experience\n- Manufacturer certifications"
+    }
+})
+
+# Repair steps, cost, timeline and prevention for each issue type
+ISSUE_DETAILS = MappingProxyType({
+    "structural_damage": {
+        "repair_steps": [
+            "Professional inspection by structural engineer",
+            "Foundation assessment and soil testing",
+            "Development of repair plan",
+            "Installation of temporary support structures",
+            "Repair or reinforce damaged structural elements",
+            "Address any underlying foundation issues",
+            "Final structural integrity verification"
+        ],
+        "estimated_cost": "$5,000 - $25,000",
+        "timeline": "2-8 weeks",
+        "prevention": [
+            "Regular structural inspections",
+            "Maintain proper drainage around foundation",
+            "Monitor for new cracks or movement",
+            "Address water issues promptly"
+        ]
+    },
+    "water_damage": {
+        "repair_steps": [
+            "Emergency water extraction",
+            "Identify and fix the water source",
+            "Industrial drying of affected areas",
+            "Moisture testing of walls and floors",
+            "Remove damaged materials",
+            "Sanitize and treat for mold prevention",
+            "Replace damaged materials"
+        ],
+        "estimated_cost": "$2,000 - $8,000",
+        "timeline": "1-2 weeks",
+        "prevention": [
+            "Regular plumbing inspections",
+            "Install water detection systems",
+            "Maintain proper ventilation",
+            "Regular gutter maintenance"
+        ]
+    },
+    "mold": {
+        "repair_steps": [
+            "Professional mold inspection",
+            "Air quality testing",
+            "Containment setup",
+            "HVAC system protection",
+            "Remove affected materials",
+            "Clean and sanitize area",
+            "Apply preventive treatments"
+        ],
+        "estimated_cost": "$500 - $6,000",
+        "timeline": "3-7 days",
+        "prevention": [
+            "Control indoor humidity (30-50%)",
+            "Fix leaks immediately",
+            "Improve ventilation",
+            "Regular inspections"
+        ]
+    },
+    "window_issues": {
+        "repair_steps": [
+            "Window inspection and assessment",
+            "Measure window opening",
+            "Remove damaged window",
+            "Repair frame if needed",
+            "Install new window",
+            "Seal and weatherproof",
+            "Test operation and efficiency"
+        ],
+        "estimated_cost": "$200 - $1,500 per window",
+        "timeline": "1-3 days",
+        "prevention": [
+            "Regular maintenance checks",
+            "Clean tracks and mechanisms",
+            "Replace weatherstripping as needed",
+            "Address drafts promptly"
+        ]
+    }
+})
+
 class IssueDetectionAgent:
+    # Keyword in a CLIP feature name -> issue_details key
+    _TYPE_MAP = {
+        "window": "window_issues",
+        "mold": "mold",
+        "water": "water_damage",
+        "structural": "structural_damage"
+    }
+    _TYPE_RE = re.compile("|".join(_TYPE_MAP))
+
     def __init__(self):
-        self.conversation_context = []
+        # Only the last 5 messages are kept for context
+        self.conversation_context = deque(maxlen=5)
         self.last_analysis = None
         self.current_issue = None
-        self.professionals = {
-            "structural_damage": {
-                "professionals": [
-                    "Structural Engineer",
-                    "Licensed Building Contractor",
-                    "Foundation Specialist",
-                    "Construction Project Manager"
-                ],
-                "qualifications": "Look for professionals with:\n- Licensed structural engineer certification\n- Experience with foundation repairs\n- Local building code knowledge\n- Insurance and bonding"
-            },
-            "water_damage": {
-                "professionals": [
-                    "Water Damage Restoration Specialist",
-                    "Licensed Plumber",
-                    "Moisture Control Expert",
-                    "Building Inspector"
-                ],
-                "qualifications": "Look for professionals with:\n- IICRC certification\n- Water damage restoration experience\n- Mold remediation knowledge\n- Insurance claim experience"
-            },
-            "mold": {
-                "professionals": [
-                    "Certified Mold Inspector",
-                    "Mold Remediation Specialist",
-                    "Indoor Air Quality Expert",
-                    "Environmental Hygienist"
-                ],
-                "qualifications": "Look for professionals with:\n- IICRC or ACAC certification\n- Mold assessment experience\n- Air quality testing capabilities\n- Remediation protocol knowledge"
-            },
-            "window_issues": {
-                "professionals": [
-                    "Window Installation Specialist",
-                    "Glass Repair Technician",
-                    "Energy Efficiency Expert",
-                    "General Contractor"
-                ],
-                "qualifications": "Look for professionals with:\n- Window installation certification\n- Energy efficiency expertise\n- Weatherization experience\n- Manufacturer certifications"
-            }
-        }
-        self.issue_details = {
-            "structural_damage": {
-                "repair_steps": [
-                    "Professional inspection by structural engineer",
-                    "Foundation assessment and soil testing",
-                    "Development of repair plan",
-                    "Installation of temporary support structures",
-                    "Repair or reinforce damaged structural elements",
-                    "Address any underlying foundation issues",
-                    "Final structural integrity verification"
-                ],
-                "estimated_cost": "$5,000 - $25,000",
-                "timeline": "2-8 weeks",
-                "prevention": [
-                    "Regular structural inspections",
-                    "Maintain proper drainage around foundation",
-                    "Monitor for new cracks or movement",
-                    "Address water issues promptly"
-                ]
-            },
-            "water_damage": {
-                "repair_steps": [
-                    "Emergency water extraction",
-                    "Identify and fix the water source",
-                    "Industrial drying of affected areas",
-                    "Moisture testing of walls and floors",
-                    "Remove damaged materials",
-                    "Sanitize and treat for mold prevention",
-                    "Replace damaged materials"
-                ],
-                "estimated_cost": "$2,000 - $8,000",
-                "timeline": "1-2 weeks",
-                "prevention": [
-                    "Regular plumbing inspections",
-                    "Install water detection systems",
-                    "Maintain proper ventilation",
-                    "Regular gutter maintenance"
-                ]
-            },
-            "mold": {
-                "repair_steps": [
-                    "Professional mold inspection",
-                    "Air quality testing",
-                    "Containment setup",
-                    "HVAC system protection",
-                    "Remove affected materials",
-                    "Clean and sanitize area",
-                    "Apply preventive treatments"
-                ],
-                "estimated_cost": "$500 - $6,000",
-                "timeline": "3-7 days",
-                "prevention": [
-                    "Control indoor humidity (30-50%)",
-                    "Fix leaks immediately",
-                    "Improve ventilation",
-                    "Regular inspections"
-                ]
-            },
-            "window_issues": {
-                "repair_steps": [
-                    "Window inspection and assessment",
-                    "Measure window opening",
-                    "Remove damaged window",
-                    "Repair frame if needed",
-                    "Install new window",
-                    "Seal and weatherproof",
-                    "Test operation and efficiency"
-                ],
-                "estimated_cost": "$200 - $1,500 per window",
-                "timeline": "1-3 days",
-                "prevention": [
-                    "Regular maintenance checks",
-                    "Clean tracks and mechanisms",
-                    "Replace weatherstripping as needed",
-                    "Address drafts promptly"
-                ]
-            }
-        }
+        self.professionals = PROFESSIONALS
+        self.issue_details = ISSUE_DETAILS
+
+    @property
+    def last_analysis(self) -> Optional[Dict[str, Any]]:
+        return self._last_analysis
+
+    @last_analysis.setter
+    def last_analysis(self, analysis: Optional[Dict[str, Any]]):
+        self._last_analysis = analysis
+        # Follow-up replies depend only on the detected issue types, which also key the chat cache
+        detected_issues = analysis.get("detected_issues") if analysis else None
+        self.issue_types = tuple(issue["type"] for issue in detected_issues) if detected_issues else ()
+        # Every follow-up about this analysis is matched against its issue types,
+        # so build their alternation once here rather than on each chat turn
+        self.issue_types_regex = re.compile("|".join(
+            re.escape(issue_type.replace("_", " ")) for issue_type in self.issue_types
+        )) if self.issue_types else None
 
     def _add_to_context(self, role: str, content: str):
         """Add message to conversation context"""
         self.conversation_context.append({"role": role, "content": content})
-        # Keep only last 5 messages for context
-        if len(self.conversation_context) > 5:
-            self.conversation_context = self.conversation_context[-5:]
 
     def _get_current_context(self) -> str:
         """Get relevant context from conversation history"""
         if not self.conversation_context:
             return ""
         return "\n".join([f"{'Bot:' if msg['role'] == 'assistant' else 'User:'} {msg['content']}" 
-                         for msg in self.conversation_context[-3:]])
+                         for msg in list(self.conversation_context)[-3:]])
 
     def analyze_image(self, features: List[PropertyFeature]):
         """Process image analysis results with chain of thought"""
@@ -355,14 +641,9 @@ class IssueDetectionAgent:
             if feature.confidence >= 0.2:
                 # Clean up the feature name to match our issue_details keys
                 feature_type = feature.feature.lower().replace(" ", "_")
-                if "window" in feature_type:
-                    feature_type = "window_issues"
-                elif "mold" in feature_type:
-                    feature_type = "mold"
-                elif "water" in feature_type:
-                    feature_type = "water_damage"
-                elif "structural" in feature_type:
-                    feature_type = "structural_damage"
+                m = self._TYPE_RE.search(feature_type)
+                if m:
+                    feature_type = self._TYPE_MAP[m.group(0)]
                 
                 issue = {
                     "type": feature_type,
@@ -390,12 +671,15 @@ class IssueDetectionAgent:
         if not detected_issues:
             response = "I didn't detect any significant issues in this image. Would you like me to look for something specific?"
         else:
-            response_parts = []
-            for issue in detected_issues:
-                issue_type = issue["type"].replace("_", " ")
-                confidence_level = "high" if issue["confidence"] > 0.7 else "moderate"
-                response_parts.append(f"I've detected {issue_type} with {confidence_level} confidence.")
-                response_parts.append(f"Quick assessment: {issue['recommendation']}")
+            response_parts = [
+                part
+                for issue in detected_issues
+                for part in (
+                    f"I've detected {issue['type'].replace('_', ' ')} with "
+                    f"{'high' if issue['confidence'] > 0.7 else 'moderate'} confidence.",
+                    f"Quick assessment: {issue['recommendation']}"
+                )
+            ]
             
             response_parts.append("\nI can provide more specific details about repair steps, prevention measures, or cost breakdown for any of these issues. What would you like to know more about?")
             response = " ".join(response_parts)
@@ -432,7 +716,8 @@ class IssueDetectionAgent:
 
             # Step 1: Analyze question type
             thoughts.append("Analyzing question type...")
-            question = question.lower()
+            if not question.islower():
+                question = question.lower()
             
             # Check if asking about professionals
             if any(word in question for word in ["who", "contact", "professional", "expert", "call", "hire"]):
@@ -574,163 +859,342 @@ class IssueDetectionAgent:
         response += "What specific aspect would you like to know more about?"
         return response
 
-# Initialize agents
-text_agent = RealEstateTextAgent()
-issue_agent = IssueDetectionAgent()
+# Agents per chat session, so one user's analysis and context never leak into another's
+MAX_SESSIONS = 1024
+_agents = OrderedDict()  # session id -> (text agent, issue agent)
+
+def get_agents(session_id: Optional[str]):
+    """Get the agents for a session, creating them on first use and evicting the least recent"""
+    key = session_id or "default"
+    agents = _agents.get(key)
+    if agents is None:
+        agents = _agents[key] = (RealEstateTextAgent(), IssueDetectionAgent())
+        if len(_agents) > MAX_SESSIONS:
+            _agents.popitem(last=False)
+    else:
+        _agents.move_to_end(key)
+    return agents
+
+def _open_image(src) -> Image.Image:
+    """Open an image as RGB, letting JPEGs decode at a reduced DCT scale"""
+    image = Image.open(src)
+    # CLIP only sees a 224px crop, so never decode a JPEG at much more than 448px (no-op for PNG)
+    image.draft("RGB", (448, 448))
+    # The transform pipeline expects 3-channel input
+    return image.convert("RGB")
 
-def get_image_embedding(image_path: str) -> np.ndarray:
+def _load_pixel_values(image_path: str) -> torch.Tensor:
+    """Decode an image file and preprocess it for CLIP"""
+    return preprocess_image(_open_image(image_path))
+
+def _decode_image(data: bytes):
+    """Decode image bytes to RGB and compute the image's perceptual hash"""
+    image = _open_image(BytesIO(data))
+    return image, int(str(imagehash.phash(image)), 16)
+
+async def _encode_image(pixel_values: torch.Tensor) -> np.ndarray:
+    """L2-normalized CLIP embedding of one preprocessed image, for scoring against TEXT_EMB"""
+    image_emb = (await submit_image(pixel_values)).numpy()
+    return image_emb / np.linalg.norm(image_emb)
+
+async def get_image_embedding(image_path: str) -> np.ndarray:
     """Get CLIP embedding for an image"""
-    image = Image.open(image_path)
-    inputs = processor(images=image, return_tensors="pt")
-    with torch.no_grad():
-        features = model.get_image_features(**inputs)
-    return features.numpy().flatten()
-
-def analyze_image_with_clip(image_path: str) -> List[PropertyFeature]:
-    """Analyze image using CLIP model"""
-    features = [
-        "water damage", "mold growth", "structural cracks", "poor lighting",
-        "broken fixtures", "paint peeling", "electrical issues", "plumbing problems",
-        "ceiling damage", "wall damage", "floor damage", "window issues"
-    ]
-    
+    # Decode and preprocess off the event loop; the forward runs on the batcher's thread
+    pixel_values = await asyncio.to_thread(_load_pixel_values, image_path)
+    # Raw (unnormalized) features, as stored in the vector store; already a contiguous
+    # 1-D float32 vector, so no flatten copy is needed
+    return (await submit_image(pixel_values)).numpy()
+
+# Analysis results are cached by the SHA-256 of the image bytes (exact repeats) and by a
+# 64-bit perceptual hash (re-encoded or resized near-duplicates)
+CLIP_CACHE_SIZE = 512
+PHASH_MAX_DISTANCE = 4
+# Exact-match results are also written here so they survive restarts, in a subdirectory
+# per model / label set / inference path since each of those changes the confidences
+CLIP_DISK_CACHE_DIR = "temp/clip_cache"
+CLIP_DISK_CACHE_MAX_FILES = 10000
+_disk_cache_dir = CLIP_DISK_CACHE_DIR
+_exact_cache = OrderedDict()  # sha256 digest -> features
+_phash_cache = OrderedDict()  # phash -> features
+
+def _cache_put(cache: OrderedDict, key, features: List[PropertyFeature]):
+    """Insert into an LRU cache, evicting the oldest entry once it is full"""
+    cache[key] = features
+    cache.move_to_end(key)
+    if len(cache) > CLIP_CACHE_SIZE:
+        cache.popitem(last=False)
+
+def _init_disk_cache():
+    """Point the disk cache at the current model's fingerprint and drop stale fingerprints"""
+    global _disk_cache_dir
+    fingerprint = hashlib.sha256(
+        json.dumps([CLIP_MODEL_NAME, FEATURES, inference_path]).encode()
+    ).hexdigest()[:16]
+    _disk_cache_dir = os.path.join(CLIP_DISK_CACHE_DIR, fingerprint)
+    os.makedirs(_disk_cache_dir, exist_ok=True)
+    for entry in os.scandir(CLIP_DISK_CACHE_DIR):
+        if entry.name != fingerprint:
+            if entry.is_dir():
+                shutil.rmtree(entry.path, ignore_errors=True)
+            else:
+                try:
+                    os.remove(entry.path)
+                except OSError:
+                    pass
+
+def _disk_cache_path(digest: bytes) -> str:
+    return os.path.join(_disk_cache_dir, f"{digest.hex()}.json")
+
+def _disk_cache_load(digest: bytes) -> Optional[List[PropertyFeature]]:
+    """Read persisted features for an image digest, if any"""
     try:
-        # If image_path is a URL, download it first
-        if image_path.startswith('http'):
-            response = requests.get(image_path)
-            image = Image.open(BytesIO(response.content))
-        else:
-            image = Image.open(image_path)
+        with open(_disk_cache_path(digest)) as f:
+            return [PropertyFeature(**item) for item in json.load(f)]
+    except (OSError, ValueError):
+        return None
+
+def _disk_cache_store(digest: bytes, features: List[PropertyFeature]):
+    """Persist the features for an image digest, pruning the oldest entries past the cap"""
+    with open(_disk_cache_path(digest), "w") as f:
+        json.dump([feature.model_dump() for feature in features], f)
+
+    entries = list(os.scandir(_disk_cache_dir))
+    if len(entries) > CLIP_DISK_CACHE_MAX_FILES:
+        entries.sort(key=lambda entry: entry.stat().st_mtime)
+        for entry in entries[:len(entries) - CLIP_DISK_CACHE_MAX_FILES]:
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
+
+async def _exact_lookup(digest: bytes) -> Optional[List[PropertyFeature]]:
+    """Return cached features for an exact image digest, from memory or disk"""
+    cached = _exact_cache.get(digest)
+    if cached is not None:
+        _exact_cache.move_to_end(digest)
+        return cached
+    cached = await asyncio.to_thread(_disk_cache_load, digest)
+    if cached is not None:
+        _cache_put(_exact_cache, digest, cached)
+    return cached
+
+def _phash_lookup(phash: int) -> Optional[List[PropertyFeature]]:
+    """Return cached features for an image within PHASH_MAX_DISTANCE bits of phash"""
+    for key, features in _phash_cache.items():
+        if bin(phash ^ key).count("1") <= PHASH_MAX_DISTANCE:
+            _phash_cache.move_to_end(key)
+            return features
+    return None
 
-        # Process image with CLIP
-        inputs = processor(images=image, text=features, return_tensors="pt", padding=True)
-        outputs = model(**inputs)
+async def analyze_image_bytes(data: bytes) -> List[PropertyFeature]:
+    """Analyze in-memory image bytes using CLIP"""
+    try:
+        # Exact repeat of an earlier upload
+        digest = hashlib.sha256(data).digest()
+        cached = await _exact_lookup(digest)
+        if cached is not None:
+            return list(cached)
+
+        # Decoding and hashing are CPU-bound, so keep them off the event loop
+        image, phash = await asyncio.to_thread(_decode_image, data)
+
+        # Near-duplicate of an earlier upload
+        cached = _phash_lookup(phash)
+        if cached is not None:
+            _cache_put(_exact_cache, digest, cached)
+            return list(cached)
+
+        # Process image with CLIP (batched with any concurrent uploads)
+        pixel_values = await asyncio.to_thread(preprocess_image, image)
+        image_emb = await _encode_image(pixel_values)
         
-        logits_per_image = outputs.logits_per_image
-        probs = logits_per_image.softmax(dim=1)[0]
+        # Compare against the cached text embeddings with a single numpy matvec
+        logits_per_image = LOGIT_SCALE * (TEXT_EMB @ image_emb)
+        probs = np.exp(logits_per_image - logits_per_image.max())
+        probs /= probs.sum()
         
-        detected_features = []
-        for feature, confidence in zip(features, probs.tolist()):
-            if confidence > 0.2:  # Confidence threshold
-                recommendation = get_recommendation(feature, confidence)
-                detected_features.append(PropertyFeature(
-                    feature=feature,
-                    confidence=confidence,
-                    recommendation=recommendation
-                ))
+        # Only build results for the features above the confidence threshold
+        idxs = np.flatnonzero(probs > 0.2)
+        detected_features = [
+            PropertyFeature(
+                feature=FEATURES[i],
+                confidence=float(probs[i]),
+                recommendation=RECOMMENDATIONS[FEATURES[i]]
+            )
+            for i in idxs
+        ]
         
-        return detected_features
+        _cache_put(_exact_cache, digest, detected_features)
+        _cache_put(_phash_cache, phash, detected_features)
+        await asyncio.to_thread(_disk_cache_store, digest, detected_features)
+        return list(detected_features)
     except Exception as e:
         print(f"Error analyzing image: {str(e)}")
         return []
 
-def get_recommendation(feature: str, confidence: float) -> str:
-    """Get a recommendation based on the detected feature"""
-    recommendations = {
-        "water damage": "Contact a water damage restoration specialist immediately. This could lead to mold and structural issues if not addressed.",
-        "mold growth": "Schedule a mold inspection and remediation service. Ensure proper ventilation and fix any water leaks.",
-        "structural cracks": "Have a structural engineer assess the severity of the cracks. This could indicate foundation issues.",
-        "poor lighting": "Consider installing additional lighting fixtures or larger windows. Good lighting can significantly improve the space.",
-        "broken fixtures": "Have a licensed contractor repair or replace the damaged fixtures. This is typically a straightforward fix.",
-        "paint peeling": "Sand the area, prime, and repaint. Check for underlying moisture issues that might be causing the paint to peel.",
-        "electrical issues": "Contact a licensed electrician for an inspection. Electrical problems can pose serious safety risks.",
-        "plumbing problems": "Have a professional plumber inspect the system. Address leaks and water pressure issues promptly.",
-        "ceiling damage": "Inspect for roof leaks and have a contractor assess the damage. This could indicate water infiltration.",
-        "wall damage": "Evaluate if it's superficial or structural. Minor repairs can be done by a general contractor.",
-        "floor damage": "Consider repairs or replacement depending on severity. Check for underlying subfloor issues.",
-        "window issues": "Have a window specialist check for proper sealing and operation. This affects energy efficiency."
-    }
+# Recommendation for each CLIP feature
+RECOMMENDATIONS: Final[Dict[str, str]] = {
+    "water damage": "Contact a water damage restoration specialist immediately. This could lead to mold and structural issues if not addressed.",
+    "mold growth": "Schedule a mold inspection and remediation service. Ensure proper ventilation and fix any water leaks.",
+    "structural cracks": "Have a structural engineer assess the severity of the cracks. This could indicate foundation issues.",
+    "poor lighting": "Consider installing additional lighting fixtures or larger windows. Good lighting can significantly improve the space.",
+    "broken fixtures": "Have a licensed contractor repair or replace the damaged fixtures. This is typically a straightforward fix.",
+    "paint peeling": "Sand the area, prime, and repaint. Check for underlying moisture issues that might be causing the paint to peel.",
+    "electrical issues": "Contact a licensed electrician for an inspection. Electrical problems can pose serious safety risks.",
+    "plumbing problems": "Have a professional plumber inspect the system. Address leaks and water pressure issues promptly.",
+    "ceiling damage": "Inspect for roof leaks and have a contractor assess the damage. This could indicate water infiltration.",
+    "wall damage": "Evaluate if it's superficial or structural. Minor repairs can be done by a general contractor.",
+    "floor damage": "Consider repairs or replacement depending on severity. Check for underlying subfloor issues.",
+    "window issues": "Have a window specialist check for proper sealing and operation. This affects energy efficiency."
+}
+
+# Keywords that indicate a chat message is about the last image analysis, compiled
+# into one automaton so a message is scanned once for all of them
+IMAGE_RELATED_KEYWORDS = [
+    "repair", "fix", "issue", "problem", "damage",
+    "cost", "price", "timeline", "time", "how long",
+    "steps", "process", "prevent", "avoid", "professional",
+    "who", "contact", "help"
+]
+
+def _build_keyword_automaton(keywords: List[str]):
+    """Compile keywords into an automaton whose payload is the matched keyword"""
+    automaton = ahocorasick.Automaton()
+    for keyword in keywords:
+        automaton.add_word(keyword, keyword)
+    automaton.make_automaton()
+    return automaton
+
+IMAGE_KEYWORDS_AC = _build_keyword_automaton(IMAGE_RELATED_KEYWORDS)
+
+# Chat replies depend only on the detected issue types and the normalized message, so
+# repeats within the TTL, from any session, are answered without running the agents
+_chat_cache = TTLCache(maxsize=2048, ttl=600)
+_NON_WORD_RE = re.compile(r"[^\w' ]+")
+
+def canonicalize_message(message: str) -> str:
+    """Lowercase, turn punctuation into spaces and collapse whitespace"""
+    return " ".join(_NON_WORD_RE.sub(" ", message.lower()).split())
+
+def _answer_chat(text_agent: RealEstateTextAgent, issue_agent: IssueDetectionAgent, msg_lower: str) -> str:
+    """Route a normalized chat message to the issue agent or the text agent"""
+    # First check if this is an image-related question
+    if issue_agent.issue_types_regex is not None:
+        # Check if question contains issue types (one regex search) or image-related keywords (one automaton pass)
+        is_image_related = issue_agent.issue_types_regex.search(msg_lower) is not None or \
+                         next(IMAGE_KEYWORDS_AC.iter(msg_lower), None) is not None
+        
+        if is_image_related:
+            response = issue_agent.handle_followup_question(msg_lower)
+            if "I don't have any recent property analysis" not in response and \
+               "I apologize, but I don't have specific information" not in response:
+                return response
     
-    return recommendations.get(feature, "Please consult a specialist for this issue.")
+    # If not image-related or no good response from issue agent, use text agent
+    return text_agent.find_best_match(msg_lower)
 
 @app.get("/")
 async def root():
     return {"message": "Welcome to Real Estate Chatbot API"}
 
 @app.post("/chat")
-async def chat(message: ChatMessage):
+async def chat(message: ChatMessage = Depends(parse_chat_message)):
     try:
+        text_agent, issue_agent = get_agents(message.session_id)
+        # Normalize once; the cache key, both agents and the keyword scan reuse it
+        msg_lower = canonicalize_message(message.message)
+
         # Update agent's last analysis if provided
-        if message.last_analysis:
+        # (the client echoes it on every turn, so only a new one is re-indexed)
+        if message.last_analysis and message.last_analysis != issue_agent.last_analysis:
             issue_agent.last_analysis = message.last_analysis
-            
-        # First check if this is an image-related question
-        if issue_agent.last_analysis and issue_agent.last_analysis.get("detected_issues"):
-            detected_issues = issue_agent.last_analysis["detected_issues"]
-            issue_types = [issue["type"].replace("_", " ") for issue in detected_issues]
-            
-            # Keywords that indicate question is about the image analysis
-            image_related_keywords = [
-                "repair", "fix", "issue", "problem", "damage",
-                "cost", "price", "timeline", "time", "how long",
-                "steps", "process", "prevent", "avoid", "professional",
-                "who", "contact", "help"
-            ]
-            
-            # Check if question contains issue types or image-related keywords
-            is_image_related = any(issue_type in message.message.lower() for issue_type in issue_types) or \
-                             any(keyword in message.message.lower() for keyword in image_related_keywords)
-            
-            if is_image_related:
-                response = issue_agent.handle_followup_question(message.message)
-                if "I don't have any recent property analysis" not in response and \
-                   "I apologize, but I don't have specific information" not in response:
-                    return {"response": response}
-        
-        # If not image-related or no good response from issue agent, use text agent
-        response = text_agent.find_best_match(message.message)
+
+        # Keyed on the analysis content rather than its client-supplied timestamp
+        cache_key = (issue_agent.issue_types, msg_lower)
+        response = _chat_cache.get(cache_key)
+        if response is None:
+            response = _chat_cache[cache_key] = _answer_chat(text_agent, issue_agent, msg_lower)
         return {"response": response}
 
     except Exception as e:
         print(f"Error in chat endpoint: {str(e)}")
         return {"response": "I apologize, but I encountered an error processing your request. Please try again."}
 
-@app.post("/upload-image")
-async def upload_image(file: UploadFile = File(...)):
-    os.makedirs("temp", exist_ok=True)
-    timestamp = int(time.time())
-    temp_file_path = f"temp/{timestamp}_{file.filename}"
+# Upload status lives in MongoDB so any worker can answer a poll; documents are
+# {_id: upload id, status: "pending" | "done" | "failed", image_url, created_at}
+# and expire UPLOAD_STATUS_TTL seconds after the upload
+UPLOAD_STATUS_TTL = 24 * 60 * 60
+
+def _uploads():
+    return get_async_db().uploads
+
+async def _upload_to_cloudinary(upload_id: str, content: bytes, filename: Optional[str]):
+    """Upload image bytes to Cloudinary and record the resulting URL or the failure"""
     try:
-        with open(temp_file_path, "wb") as buffer:
-            content = await file.read()
-            buffer.write(content)
-        
-        # Upload to Cloudinary
-        upload_result = cloudinary.uploader.upload(temp_file_path)
-        image_url = upload_result["secure_url"]
-        
-        # Analyze with CLIP
-        features = analyze_image_with_clip(temp_file_path)
-        
-        # Convert features to proper format for the agent
-        detected_issues = []
-        for feature in features:
-            issue_type = feature.feature.lower().replace(" ", "_")
-            detected_issues.append({
-                "type": issue_type,
-                "confidence": feature.confidence,
-                "recommendation": feature.recommendation
-            })
-        
-        # Store analysis in agent and get response
-        issue_agent.last_analysis = {
-            "timestamp": datetime.now().isoformat(),
-            "detected_issues": detected_issues,
-            "image_url": image_url
-        }
-        
-        response = issue_agent.analyze_image(features)
-        
-        return {
-            "image_url": image_url,
-            "response": response,
-            "features": [{"type": f.feature, "confidence": f.confidence, "recommendation": f.recommendation} for f in features],
-            "last_analysis": issue_agent.last_analysis
-        }
+        # The SDK is blocking, so run it in a thread
+        upload_result = await asyncio.to_thread(
+            get_uploader().upload, BytesIO(content), filename=filename
+        )
+        update = {"status": "done", "image_url": upload_result["secure_url"]}
+    except Exception as e:
+        print(f"Error uploading image to Cloudinary: {str(e)}")
+        update = {"status": "failed"}
+    await _uploads().update_one({"_id": upload_id}, {"$set": update})
+
+@app.get("/upload-image/{upload_id}")
+async def get_upload(upload_id: str):
+    upload = await _uploads().find_one({"_id": upload_id})
+    if upload is None:
+        raise HTTPException(status_code=404, detail="Unknown upload")
+    return {"upload_id": upload_id, "status": upload["status"], "image_url": upload.get("image_url")}
+
+@app.post("/upload-image", status_code=202)
+async def upload_image(
+    background_tasks: BackgroundTasks,
+    file: UploadFile = File(...),
+    session_id: Optional[str] = Form(None)
+):
+    text_agent, issue_agent = get_agents(session_id)
+    upload_id = uuid.uuid4().hex
+    # Both Cloudinary and CLIP take the bytes directly, so nothing is written to disk
+    content = await file.read()
     
-    finally:
-        if os.path.exists(temp_file_path):
-            os.remove(temp_file_path)
+    # Upload to Cloudinary after the response is sent; the URL is served by
+    # GET /upload-image/{upload_id} once it is ready
+    await _uploads().insert_one({"_id": upload_id, "status": "pending", "created_at": datetime.utcnow()})
+    background_tasks.add_task(_upload_to_cloudinary, upload_id, content, file.filename)
+    
+    # Analyze with CLIP
+    features = await analyze_image_bytes(content)
+    
+    # Convert features to proper format for the agent
+    detected_issues = []
+    for feature in features:
+        issue_type = feature.feature.lower().replace(" ", "_")
+        detected_issues.append({
+            "type": issue_type,
+            "confidence": feature.confidence,
+            "recommendation": feature.recommendation
+        })
+    
+    # Store analysis in agent and get response
+    issue_agent.last_analysis = {
+        "timestamp": datetime.now().isoformat(),
+        "detected_issues": detected_issues
+    }
+    
+    response = issue_agent.analyze_image(features)
+    # analyze_image() stores a fresh analysis, so tag that one with the upload
+    issue_agent.last_analysis["upload_id"] = upload_id
+    
+    return {
+        "upload_id": upload_id,
+        "status": "pending",
+        "image_url": None,
+        "response": response,
+        "features": [{"type": f.feature, "confidence": f.confidence, "recommendation": f.recommendation} for f in features],
+        "last_analysis": issue_agent.last_analysis
+    }
 
 if __name__ == "__main__":
     import uvicorn
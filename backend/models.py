@@ -1,7 +1,27 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, JSON, Text
+from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, Text, LargeBinary, Index
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.orm import relationship
-from sqlalchemy.sql import func
+from datetime import datetime, timezone
 from database import Base
+import numpy as np
+
+def utcnow() -> datetime:
+    """Insert-time timestamp, set client-side so no server default has to be read back"""
+    return datetime.now(timezone.utc)
+
+# CLIP embeddings are stored as raw float16 bytes (1 KB for 512 dims) rather than a JSON
+# list of floats. They are the unnormalized image features; their components are far
+# inside float16's range and its ~1e-3 relative precision doesn't depend on magnitude,
+# so cosine similarities computed after decoding stay within ~1e-3
+EMBEDDING_DTYPE = np.float16
+
+def encode_embedding(embedding) -> bytes:
+    """Pack a CLIP embedding into bytes for PropertyImage.clip_features"""
+    return np.asarray(embedding, dtype=EMBEDDING_DTYPE).tobytes()
+
+def decode_embedding(data: bytes) -> np.ndarray:
+    """Unpack PropertyImage.clip_features back into a float32 vector"""
+    return np.frombuffer(data, dtype=EMBEDDING_DTYPE).astype(np.float32, copy=False)
 
 class Property(Base):
     __tablename__ = "properties"
@@ -9,8 +29,14 @@ class Property(Base):
     id = Column(Integer, primary_key=True, index=True)
     address = Column(String, nullable=False)
     location = Column(String, nullable=False)
-    features = Column(JSON)  # Store property features as JSON
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    features = Column(JSONB)  # Store property features as JSONB
+    created_at = Column(DateTime(timezone=True), default=utcnow)
+
+    # GIN index for containment queries such as features @> '{"type": "ceiling_damage"}'
+    __table_args__ = (
+        Index("ix_properties_features_gin", "features", postgresql_using="gin",
+              postgresql_ops={"features": "jsonb_path_ops"}),
+    )
     
     # Relationship with images
     images = relationship("PropertyImage", back_populates="property")
@@ -21,9 +47,14 @@ class PropertyImage(Base):
     id = Column(Integer, primary_key=True, index=True)
     property_id = Column(Integer, ForeignKey("properties.id"))
     file_path = Column(String, nullable=False)
-    clip_features = Column(JSON)  # Store CLIP embeddings as JSON
-    detected_features = Column(JSON)  # Changed from ARRAY to JSON
-    upload_date = Column(DateTime(timezone=True), server_default=func.now())
+    clip_features = Column(LargeBinary)  # CLIP embedding bytes, see encode_embedding
+    detected_features = Column(JSONB)  # Changed from ARRAY to JSONB
+    upload_date = Column(DateTime(timezone=True), default=utcnow)
+
+    __table_args__ = (
+        Index("ix_property_images_detected_features_gin", "detected_features", postgresql_using="gin",
+              postgresql_ops={"detected_features": "jsonb_path_ops"}),
+    )
     
     # Relationship with property
     property = relationship("Property", back_populates="images")
@@ -34,6 +65,10 @@ class ImageAnalysis(Base):
     id = Column(Integer, primary_key=True, index=True)
     image_id = Column(Integer, ForeignKey("property_images.id"))
     analysis_type = Column(String)  # e.g., 'CLIP', 'OCR'
-    results = Column(JSON)  # Store analysis results as JSON
+    results = Column(JSONB)  # Store analysis results as JSONB
     confidence_score = Column(Float)
-    created_at = Column(DateTime(timezone=True), server_default=func.now()) 
\ No newline at end of file
+    created_at = Column(DateTime(timezone=True), default=utcnow)
+
+# Newest-first indexes for recency queries such as the latest analyses of an image
+Index("ix_property_images_upload_date_desc", PropertyImage.upload_date.desc())
+Index("ix_image_analysis_created_desc", ImageAnalysis.image_id, ImageAnalysis.created_at.desc())
@@ -19,6 +19,8 @@ import { Send as SendIcon, CloudUpload as CloudUploadIcon, AllInclusive as Infin
 
 // API Configuration
 const API_URL = process.env.REACT_APP_API_URL || 'http://localhost:8000';
+const UPLOAD_POLL_INTERVAL_MS = 1000;
+const UPLOAD_POLL_ATTEMPTS = 30;
 
 // Custom theme
 const theme = createTheme({
@@ -101,7 +103,11 @@ const App: React.FC = () => {
   const [location, setLocation] = useState('');
   const [loading, setLoading] = useState(false);
   const [lastAnalysis, setLastAnalysis] = useState<any>(null);
+  // Identifies this chat to the backend, which keeps agent state per session
+  const [sessionId] = useState(() => Math.random().toString(36).slice(2) + Date.now().toString(36));
   const messagesEndRef = useRef<null | HTMLDivElement>(null);
+  // Object URLs for local image previews, released when the app unmounts
+  const previewUrlsRef = useRef<string[]>([]);
 
   const scrollToBottom = () => {
     messagesEndRef.current?.scrollIntoView({ behavior: "smooth" });
@@ -111,6 +117,33 @@ const App: React.FC = () => {
     scrollToBottom();
   }, [messages]);
 
+  useEffect(() => {
+    const previewUrls = previewUrlsRef.current;
+    return () => previewUrls.forEach(url => URL.revokeObjectURL(url));
+  }, []);
+
+  // The Cloudinary upload finishes after the analysis is returned, so poll for its URL
+  // and swap it in for the local preview once it is ready
+  const pollUpload = async (uploadId: string, previewUrl: string) => {
+    for (let attempt = 0; attempt < UPLOAD_POLL_ATTEMPTS; attempt++) {
+      await new Promise(resolve => setTimeout(resolve, UPLOAD_POLL_INTERVAL_MS));
+      try {
+        const response = await axios.get(`${API_URL}/upload-image/${uploadId}`);
+        if (response.data.status === 'done') {
+          const imageUrl = response.data.image_url;
+          setMessages(prev => prev.map(message =>
+            message.imageUrl === previewUrl ? { ...message, imageUrl } : message
+          ));
+          return;
+        }
+        if (response.data.status === 'failed') return;
+      } catch (error) {
+        console.error('Error checking image upload:', error);
+        return;
+      }
+    }
+  };
+
   const onDrop = async (acceptedFiles: File[]) => {
     if (acceptedFiles.length === 0) return;
 
@@ -118,6 +151,7 @@ const App: React.FC = () => {
     const file = acceptedFiles[0];
     const formData = new FormData();
     formData.append('file', file);
+    formData.append('session_id', sessionId);
 
     try {
       const response = await axios.post(`${API_URL}/upload-image`, formData, {
@@ -130,10 +164,21 @@ const App: React.FC = () => {
         setLastAnalysis(response.data.last_analysis);
       }
 
+      // The Cloudinary upload finishes in the background, so show the local file
+      let imageUrl = response.data.image_url;
+      if (!imageUrl) {
+        imageUrl = URL.createObjectURL(file);
+        previewUrlsRef.current.push(imageUrl);
+      }
+
       setMessages(prev => [...prev, 
-        { type: 'user', content: 'Uploaded image for analysis', imageUrl: response.data.image_url },
+        { type: 'user', content: 'Uploaded image for analysis', imageUrl },
         { type: 'bot', content: response.data.response }
       ]);
+
+      if (!response.data.image_url && response.data.upload_id) {
+        pollUpload(response.data.upload_id, imageUrl);
+      }
     } catch (error) {
       console.error('Error uploading image:', error);
       setMessages(prev => [...prev, 
@@ -163,6 +208,7 @@ const App: React.FC = () => {
     try {
       const response = await axios.post(`${API_URL}/chat`, {
         message: userMessage,
+        session_id: sessionId,
         location: location || undefined,
         last_analysis: lastAnalysis
       });